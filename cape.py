@@ -1,7 +1,9 @@
+import hashlib
+import io
+
 import streamlit as st
 import pandas as pd
 import numpy as np
-from metpy.units import units
 from metpy.calc import k_index, lifted_index, showalter_index
 import altair as alt
 
@@ -12,8 +14,188 @@ st.set_page_config(
     page_icon="🌩️"
 )
 
+# ------------------- CACHED HELPERS -------------------
+# Pressure levels (hPa) that K-Index, Lifted Index and Showalter Index read
+INDEX_LEVELS_HPA = np.array([500.0, 700.0, 850.0])
+
+# Per-index thresholds for classify(): searchsorted gives 0 = low,
+# 1 = moderate, 2 = high. LI and SI are negated so that, as for K, a more
+# unstable value sorts higher.
+K_THRESH = np.array([25.0, 35.0])    # side="right": K >= 35 is high
+LI_THRESH = np.array([3.0, 6.0])     # on -LI, side="left": LI < -6 is high
+SI_THRESH = np.array([-1.0, 3.0])    # on -SI, side="left": SI < -3 is high
+
+# Final assessment, indexed by classify()
+FINAL_TEXT = (
+    "🌤️ Low chance of thunderstorms",
+    "⛈️ Moderate chance of thunderstorms",
+    "🌩️ High chance of thunderstorms",
+)
+FINAL_COLOR = ("#15803d", "#ca8a04", "#b91c1c")
+
+# Most levels drawn in the sounding chart; denser profiles are thinned
+MAX_PLOT_LEVELS = 500
+
+# Entries kept per cached function; older uploads are evicted first
+CACHE_MAX_ENTRIES = 32
+
+
+def _read_table(file_bytes: bytes, name: str, **kwargs) -> pd.DataFrame:
+    if name.endswith(".csv"):
+        return pd.read_csv(io.BytesIO(file_bytes), engine="c", **kwargs)
+    engine = "openpyxl" if name.endswith(".xlsx") else None
+    return pd.read_excel(io.BytesIO(file_bytes), engine=engine, **kwargs)
+
+
+# The cached readers below are keyed on file_key (a short hash of the upload);
+# the bytes themselves are passed as _file_bytes, which Streamlit does not hash.
+def file_hash(file_bytes: bytes) -> str:
+    return hashlib.blake2b(file_bytes, digest_size=8).hexdigest()
+
+
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES)
+def read_preview(file_key: str, name: str, _file_bytes: bytes) -> pd.DataFrame:
+    """First rows only: enough for the preview table and column detection."""
+    return _read_table(_file_bytes, name, nrows=10)
+
+
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES)
+def load_sounding(file_key: str, name: str, usecols: tuple[str, ...],
+                  _file_bytes: bytes) -> pd.DataFrame:
+    """Parse only the selected columns, as float32 when they are clean."""
+    # Pass positions, not labels: pandas reads integer labels in usecols
+    # (numeric Excel headers) as positions and would pick the wrong columns.
+    header = read_preview(file_key, name, _file_bytes).columns
+    cols = sorted({header.get_loc(col) for col in usecols})
+    try:
+        return _read_table(_file_bytes, name, usecols=cols, dtype=np.float32)
+    except ValueError:
+        # Unit rows / text markers in the data: coerce them to NaN in one pass.
+        raw = _read_table(_file_bytes, name, usecols=cols)
+        return raw.apply(pd.to_numeric, errors="coerce", downcast="float")
+
+
+def prepare_profile(df: pd.DataFrame, temp_col: str, dew_col: str,
+                    press_col: str) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """NaN-free (P, T, Td) float32 arrays sorted from surface to top.
+
+    Repeated pressures (common in exports rounded to whole hPa) keep only
+    their first row, so every level is unambiguous and index_levels()
+    brackets the same rows metpy would interpolate on the full profile.
+    """
+    prof = df[[temp_col, dew_col, press_col]].dropna()
+
+    # float32 is ample for indices reported to one decimal
+    P = prof[press_col].to_numpy(dtype=np.float32)
+    order = np.argsort(-P, kind="stable")
+    P = P[order]
+    first = np.ones(P.size, dtype=bool)
+    first[1:] = P[1:] != P[:-1]
+    order = order[first]
+    return (P[first],
+            prof[temp_col].to_numpy(dtype=np.float32)[order],
+            prof[dew_col].to_numpy(dtype=np.float32)[order])
+
+
+@st.cache_resource
+def _units():
+    """hPa and degC unit objects, looked up once per server process."""
+    from metpy.units import units
+    return units.hectopascal, units.degC
+
+
+def index_levels(P_hpa: np.ndarray) -> np.ndarray:
+    """Rows of a surface-to-top profile that bracket the index levels.
+
+    metpy interpolates linearly between neighbouring levels, so keeping the
+    level on each side of 850/700/500 hPa gives the same indices as the full
+    profile at a fraction of the cost.
+    """
+    n = len(P_hpa)
+    p_asc = P_hpa[::-1]
+    hi = np.searchsorted(p_asc, INDEX_LEVELS_HPA)
+    rows = np.clip(np.concatenate([hi - 1, hi]), 0, n - 1)
+    return np.unique(n - 1 - rows)
+
+
+def detect_column(columns: pd.Index, mask: np.ndarray):
+    """First column where mask is True, or None."""
+    hits = columns[mask]
+    return hits[0] if len(hits) else None
+
+
+@st.cache_resource(max_entries=CACHE_MAX_ENTRIES)
+def _alt_opts(cols: tuple[str, ...]) -> tuple[str, ...]:
+    """Altitude selectbox options: "(None)" followed by the file's columns."""
+    return ("(None)",) + cols
+
+
+def _level(thresh: np.ndarray, value: float, side: str) -> int:
+    # A NaN index says nothing about instability
+    if np.isnan(value):
+        return 0
+    return int(np.searchsorted(thresh, value, side=side))
+
+
+def classify(k_val: float, li_val: float, si_val: float) -> int:
+    """Thunderstorm chance code: 0 = low, 1 = moderate, 2 = high.
+
+    The most unstable of the three indices decides.
+    """
+    return max(_level(K_THRESH, k_val, "right"),
+               _level(LI_THRESH, -li_val, "left"),
+               _level(SI_THRESH, -si_val, "left"))
+
+
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES)
+def compute_indices(P_hpa: np.ndarray, T_c: np.ndarray,
+                    Td_c: np.ndarray) -> tuple[float, float, float]:
+    """K-Index, Lifted Index and Showalter Index for one profile."""
+    hPa, degC = _units()
+    P = P_hpa * hPa
+    T = T_c * degC
+    Td = Td_c * degC
+
+    K = k_index(P, T, Td)
+    LI = lifted_index(P, T, Td)
+    SI = showalter_index(P, T, Td)
+
+    # K is 0-d, LI and SI come back as 1-element arrays: read the scalar out
+    return (float(np.asarray(K.m).item()),
+            float(np.asarray(LI.m).item()),
+            float(np.asarray(SI.m).item()))
+
+
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES)
+def sounding_payload(file_key: str, name: str, temp_col: str, dew_col: str,
+                     press_col: str, _file_bytes: bytes):
+    """Indices and chart data for one file + column choice.
+
+    Returns ``((k_val, li_val, si_val), plot_df)``, or None when the selected
+    columns hold no numeric rows. A rerun that changes nothing is a single
+    lookup on small keys instead of the whole read/clean/metpy pipeline.
+    """
+    data = load_sounding(file_key, name, (temp_col, dew_col, press_col),
+                         _file_bytes)
+    P, T, Td = prepare_profile(data, temp_col, dew_col, press_col)
+    if P.size == 0:
+        return None
+
+    # Only the levels around 850/700/500 hPa; the full profile is plotted
+    rows = index_levels(P)
+    indices = compute_indices(P[rows], T[rows], Td[rows])
+
+    step = max(1, -(-len(P) // MAX_PLOT_LEVELS))
+    plot_df = pd.DataFrame({
+        "Pressure (hPa)": P[::step],
+        "Temperature (°C)": T[::step],
+        "Dew Point (°C)": Td[::step]
+    })
+    return indices, plot_df
+
+
 # ------------------- SMALL CSS TWEAKS -------------------
-st.markdown("""
+CSS_STR = """
     <style>
         .big-title {
             font-size: 32px !important;
@@ -30,16 +212,18 @@ st.markdown("""
             background-color: #f9fafb;
         }
     </style>
-""", unsafe_allow_html=True)
+"""
 
 # ------------------- HEADER -------------------
-st.markdown('<p class="big-title">🌩️ Thunderstorm Chance from Sounding File</p>', unsafe_allow_html=True)
-st.markdown(
+HEADER_HTML = (
+    '<p class="big-title">🌩️ Thunderstorm Chance from Sounding File</p>\n'
     '<p class="sub">Upload your STA / sounding file and get K-Index, '
-    'Lifted Index, Showalter Index and a final thunderstorm assessment.</p>',
-    unsafe_allow_html=True
+    'Lifted Index, Showalter Index and a final thunderstorm assessment.</p>'
 )
 
+# Styles and header go out as a single element rather than three
+st.markdown(CSS_STR + HEADER_HTML, unsafe_allow_html=True)
+
 # ------------------- SIDEBAR -------------------
 with st.sidebar:
     st.header("📂 Upload Data")
@@ -53,33 +237,24 @@ with st.sidebar:
     st.markdown("- Dew Point")
     st.markdown("- Pressure")
 
-# ------------------- MAIN LOGIC -------------------
-if uploaded_file is not None:
-
-    # Read file
-    if uploaded_file.name.endswith(".csv"):
-        df = pd.read_csv(uploaded_file)
-    else:
-        df = pd.read_excel(uploaded_file)
-
-    st.success("✅ File uploaded successfully!")
-
-    with st.expander("📄 Preview data (top 10 rows)"):
-        st.dataframe(df.head(10), use_container_width=True)
-
+# ------------------- RESULTS -------------------
+# A fragment: changing a column selectbox reruns only this function, not the
+# header, sidebar and preview above it.
+@st.fragment
+def render_results(df: pd.DataFrame, file_key: str, name: str,
+                   file_bytes: bytes):
+    """Column pickers, indices, assessment and charts for one upload."""
     # -------- Auto-detect columns --------
-    temp_col = dew_col = press_col = alt_col = None
-
-    for col in df.columns:
-        name = col.lower()
-        if "temp" in name and temp_col is None:
-            temp_col = col
-        if "dew" in name and dew_col is None:
-            dew_col = col
-        if "press" in name and press_col is None:
-            press_col = col
-        if ("alt" in name or "height" in name) and alt_col is None:
-            alt_col = col
+    names = df.columns.astype(str).str.lower()
+    is_dew = names.str.contains("dew", regex=False)
+
+    # "Dew Point Temp" is a dew point column, not the temperature
+    temp_col = detect_column(
+        df.columns, names.str.contains("temp", regex=False) & ~is_dew)
+    dew_col = detect_column(df.columns, is_dew)
+    press_col = detect_column(
+        df.columns, names.str.contains("press", regex=False))
+    alt_col = detect_column(df.columns, names.str.contains("alt|height"))
 
     if temp_col is None:
         temp_col = df.columns[0]
@@ -104,124 +279,108 @@ if uploaded_file is not None:
     with c4:
         alt_col = st.selectbox(
             "Altitude (optional)",
-            ["(None)"] + list(df.columns),
+            _alt_opts(tuple(df.columns)),
             index=0
         )
 
     st.markdown("---")
 
-    # -------- Prepare sounding profile --------
-    prof = df[[temp_col, dew_col, press_col]].copy()
-    prof[temp_col] = pd.to_numeric(prof[temp_col], errors="coerce")
-    prof[dew_col] = pd.to_numeric(prof[dew_col], errors="coerce")
-    prof[press_col] = pd.to_numeric(prof[press_col], errors="coerce")
-    prof.dropna(inplace=True)
+    # -------- Calculate indices --------
+    try:
+        payload = sounding_payload(file_key, name, temp_col, dew_col,
+                                   press_col, file_bytes)
+    except Exception as e:
+        st.error(f"❌ Error calculating indices: {e}")
+        return
 
-    if prof.empty:
+    if payload is None:
         st.error("❌ No valid numeric data found.")
-        st.stop()
+        return
 
-    # Sort from surface to top
-    prof = prof.sort_values(by=press_col, ascending=False)
+    (k_val, li_val, si_val), plot_df = payload
 
-    P = prof[press_col].values * units.hectopascal
-    T = prof[temp_col].values * units.degC
-    Td = prof[dew_col].values * units.degC
+    # -------- Final assessment --------
+    final_code = classify(k_val, li_val, si_val)
+    final_text = FINAL_TEXT[final_code]
+    final_color = FINAL_COLOR[final_code]
 
-    try:
-        # -------- Calculate indices --------
-        K = k_index(P, T, Td)
-        LI = lifted_index(P, T, Td)
-        SI = showalter_index(P, T, Td)
-
-        k_val = float(np.nanmean(K.m))
-        li_val = float(np.nanmean(LI.m))
-        si_val = float(np.nanmean(SI.m))
-
-        # -------- Final assessment --------
-        if (k_val >= 35) or (li_val < -6) or (si_val < -3):
-            final_text = "🌩️ High chance of thunderstorms"
-            final_color = "#b91c1c"
-        elif (25 <= k_val < 35) or (-6 <= li_val < -3) or (-3 <= si_val < 1):
-            final_text = "⛈️ Moderate chance of thunderstorms"
-            final_color = "#ca8a04"
-        else:
-            final_text = "🌤️ Low chance of thunderstorms"
-            final_color = "#15803d"
-
-        # -------- Display results --------
-        colA, colB = st.columns([2, 3])
-
-        with colA:
-            st.markdown('<div class="card">', unsafe_allow_html=True)
-            st.markdown("#### 🌩️ Thunderstorm Assessment")
-            st.markdown(
-                f"<p style='font-size:20px;font-weight:600;color:{final_color};'>"
-                f"{final_text}</p>",
-                unsafe_allow_html=True
-            )
-            st.markdown('</div>', unsafe_allow_html=True)
-
-        with colB:
-            x1, x2, x3 = st.columns(3)
-            x1.metric("K-Index", f"{k_val:.1f}")
-            x2.metric("Lifted Index", f"{li_val:.1f}")
-            x3.metric("Showalter Index", f"{si_val:.1f}")
-
-        st.markdown("---")
-        st.markdown("### 📈 Sounding & Indices")
-
-        # -------- GRAPH 1: Temp & Dew Point vs Pressure --------
-        plot_df = pd.DataFrame({
-            "Pressure (hPa)": prof[press_col].values,
-            "Temperature (°C)": prof[temp_col].values,
-            "Dew Point (°C)": prof[dew_col].values
-        })
-
-        plot_long = plot_df.melt(
-            id_vars="Pressure (hPa)",
-            var_name="Variable",
-            value_name="Value"
+    # -------- Display results --------
+    colA, colB = st.columns([2, 3])
+
+    with colA:
+        st.markdown('<div class="card">', unsafe_allow_html=True)
+        st.markdown("#### 🌩️ Thunderstorm Assessment")
+        st.markdown(
+            f"<p style='font-size:20px;font-weight:600;color:{final_color};'>"
+            f"{final_text}</p>",
+            unsafe_allow_html=True
         )
+        st.markdown('</div>', unsafe_allow_html=True)
+
+    with colB:
+        x1, x2, x3 = st.columns(3)
+        x1.metric("K-Index", f"{k_val:.1f}")
+        x2.metric("Lifted Index", f"{li_val:.1f}")
+        x3.metric("Showalter Index", f"{si_val:.1f}")
 
-        temp_chart = (
-            alt.Chart(plot_long)
-            .mark_line(point=True)
-            .encode(
-                x="Value:Q",
-                y=alt.Y("Pressure (hPa):Q", sort="descending"),
-                color="Variable:N",
-                tooltip=["Pressure (hPa)", "Variable", "Value"]
-            )
-            .properties(height=350)
+    st.markdown("---")
+    st.markdown("### 📈 Sounding & Indices")
+
+    # -------- GRAPH 1: Temp & Dew Point vs Pressure --------
+    temp_chart = (
+        alt.Chart(plot_df)
+        .transform_fold(
+            ["Temperature (°C)", "Dew Point (°C)"],
+            as_=["Variable", "Value"]
         )
+        .mark_line()
+        .encode(
+            x="Value:Q",
+            y=alt.Y("Pressure (hPa):Q", sort="descending"),
+            color="Variable:N"
+        )
+        .properties(height=350)
+    )
 
-        # -------- GRAPH 2: Indices bar chart --------
-        idx_df = pd.DataFrame({
-            "Index": ["K-Index", "Lifted Index", "Showalter Index"],
-            "Value": [k_val, li_val, si_val]
-        })
-
-        idx_chart = (
-            alt.Chart(idx_df)
-            .mark_bar()
-            .encode(
-                x=alt.X("Index:N", title=""),
-                y=alt.Y("Value:Q"),
-                tooltip=["Index", "Value"]
-            )
-            .properties(height=350)
+    # -------- GRAPH 2: Indices bar chart --------
+    idx_df = pd.DataFrame({
+        "Index": ["K-Index", "Lifted Index", "Showalter Index"],
+        "Value": [k_val, li_val, si_val]
+    })
+
+    idx_chart = (
+        alt.Chart(idx_df)
+        .mark_bar()
+        .encode(
+            x=alt.X("Index:N", title=""),
+            y=alt.Y("Value:Q"),
+            tooltip=["Index", "Value"]
         )
+        .properties(height=350)
+    )
 
-        # -------- Display both graphs side-by-side --------
-        g1, g2 = st.columns(2)
-        with g1:
-            st.altair_chart(temp_chart, use_container_width=True)
-        with g2:
-            st.altair_chart(idx_chart, use_container_width=True)
+    # -------- Display both graphs side-by-side --------
+    g1, g2 = st.columns(2)
+    with g1:
+        st.altair_chart(temp_chart, use_container_width=True)
+    with g2:
+        st.altair_chart(idx_chart, use_container_width=True)
 
-    except Exception as e:
-        st.error(f"❌ Error calculating indices: {e}")
+
+# ------------------- MAIN LOGIC -------------------
+if uploaded_file is not None:
+
+    # Read header + first rows; the full parse waits for the column choice
+    file_bytes = uploaded_file.getvalue()
+    file_key = file_hash(file_bytes)
+    df = read_preview(file_key, uploaded_file.name, file_bytes)
+
+    st.success("✅ File uploaded successfully!")
+
+    with st.expander("📄 Preview data (top 10 rows)"):
+        st.dataframe(df.head(10), use_container_width=True)
+
+    render_results(df, file_key, uploaded_file.name, file_bytes)
 
 else:
     st.info("👆 Please upload your STA / sounding file to begin.")
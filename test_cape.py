@@ -0,0 +1,23 @@
+import numpy as np
+import pandas as pd
+
+import cape
+
+
+def test_index_levels_match_full_profile_with_duplicate_pressures():
+    rng = np.random.default_rng(0)
+    P = np.round(np.linspace(1000, 200, 3000))
+    T = 30 - 6.5 * (44.33 * (1 - (P / 1013.25) ** 0.1903))
+    T = T + rng.normal(0, 1, P.size)
+    Td = T - 5 - rng.uniform(0, 3, P.size)
+    df = pd.DataFrame({"p": P, "t": T, "d": Td}).sample(frac=1, random_state=0)
+
+    P, T, Td = cape.prepare_profile(df, "t", "d", "p")
+    rows = cape.index_levels(P)
+
+    assert np.all(np.diff(P) < 0)
+    np.testing.assert_allclose(
+        cape.compute_indices(P[rows], T[rows], Td[rows]),
+        cape.compute_indices(P, T, Td),
+        atol=1e-3
+    )